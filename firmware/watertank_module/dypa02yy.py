@@ -3,8 +3,99 @@
 Dit is een minimale placeholder zodat de module kan opstarten en BLE kan draaien
 zonder echte sensor. Implementeer `read_mm()` om een float in millimeters terug
 te geven wanneer de echte sensor wordt gekoppeld.
+
+`parse_mm_tenths()` parseert een ASCII-meetregel direct op de ruwe bytes
+(Viper-emitter: geen decode, geen tussentijdse strings).
 """
 
+import micropython
+from micropython import const
+
+# ASCII-codes en limieten voor parse_mm_tenths; const() vouwt ze in de code
+_CH_SPACE = const(32)
+_CH_PLUS = const(43)
+_CH_MINUS = const(45)
+_CH_DOT = const(46)
+_CH_0 = const(48)
+_CH_9 = const(57)
+_CH_E = const(69)
+_CH_e = const(101)
+_MAX_DIGITS = const(7)
+
+# Resultaatcodes van parse_mm_tenths naast een geldige waarde (>= 0)
+PARSE_INVALID = const(-1)       # leeg, commentaar of geen getal: negeren
+PARSE_OUT_OF_RANGE = const(-2)  # wel een getal, maar negatief, te groot of met exponent
+
+
+@micropython.viper
+def parse_mm_tenths(buf: ptr8, n: int) -> int:
+    """Parse een ASCII-regel als "123" of "123.4" naar tienden van mm.
+
+    Witruimte (incl. CR) rond het getal wordt genegeerd; extra decimalen worden
+    afgekapt. Retourneert `PARSE_INVALID` bij lege of corrupte regels (b.v.
+    commentaar "#") en `PARSE_OUT_OF_RANGE` voor getallen die geen plausibele
+    meting zijn (teken "-", meer dan `_MAX_DIGITS` cijfers, exponent), zodat de
+    aanroeper die als mislukte meting kan tellen.
+    """
+    acc = 0
+    digits = 0   # cijfers vóór de punt
+    frac = -1    # -1: nog geen '.', anders aantal verwerkte decimalen (max 1)
+    fdigits = 0  # cijfers na de punt
+    sign = 0     # 1: voorteken gezien
+    neg = 0
+    over = 0     # 1: meer cijfers dan _MAX_DIGITS
+    exp = -1     # -1: geen exponent, anders aantal exponentcijfers
+    esign = 0
+    done = 0
+    i = 0
+    while i < n:
+        c = int(buf[i])
+        i += 1
+        if c <= _CH_SPACE:
+            if digits > 0 or frac >= 0 or sign > 0:
+                done = 1
+            continue
+        if done:
+            return PARSE_INVALID
+        if exp >= 0:
+            if c >= _CH_0 and c <= _CH_9:
+                exp += 1
+            elif (c == _CH_MINUS or c == _CH_PLUS) and exp == 0 and esign == 0:
+                esign = 1
+            else:
+                return PARSE_INVALID
+        elif c >= _CH_0 and c <= _CH_9:
+            if frac < 0:
+                digits += 1
+                if digits > _MAX_DIGITS:
+                    over = 1
+                else:
+                    acc = acc * 10 + (c - _CH_0)
+            else:
+                fdigits += 1
+                if frac == 0:
+                    acc = acc * 10 + (c - _CH_0)
+                    frac = 1
+        elif c == _CH_DOT:
+            if frac >= 0:
+                return PARSE_INVALID
+            frac = 0
+        elif (c == _CH_MINUS or c == _CH_PLUS) and sign == 0 and digits == 0 and frac < 0:
+            sign = 1
+            if c == _CH_MINUS:
+                neg = 1
+        elif (c == _CH_E or c == _CH_e) and digits + fdigits > 0:
+            exp = 0
+        else:
+            return PARSE_INVALID
+    if digits + fdigits == 0 or exp == 0:
+        return PARSE_INVALID
+    if frac <= 0:
+        acc = acc * 10
+    if over != 0 or exp > 0 or (neg != 0 and acc > 0):
+        return PARSE_OUT_OF_RANGE
+    return acc
+
 
 class DYPA02YY:
     # Minimal stub driver; returns None so the module can boot and BLE can run
@@ -5,12 +5,27 @@ hysterese-gebaseerde toestandsmachine (OK/LOW/BOTTOM/FAULT). De pijplijn is
 geschikt voor lage samplefrequenties en beperkt geheugen.
 """
 
+import array
+
+try:
+    import micropython
+except ImportError:  # CPython (tests/tools): @micropython.native wordt een no-op
+    class micropython:
+        native = staticmethod(lambda f: f)
+
+# Toestanden zijn unieke (geïnterneerde) constanten: vergelijk met `is`, wijs
+# altijd deze namen toe en nooit een losse string-literal.
 STATE_OK = "OK"
 STATE_LOW = "LOW"
 STATE_BOTTOM = "BOTTOM"
 STATE_FAULT = "FAULT"
 
+# Startwaarden voor obs_min/obs_max: "nog geen observatie"
+_INF = float("inf")
+_NEG_INF = float("-inf")
 
+
+@micropython.native
 def clamp(x, a, b):
     """Beperk `x` tot het gesloten interval [a, b]."""
     return a if x < a else (b if x > b else x)
@@ -20,100 +35,191 @@ class LevelEstimator:
     """Kleine helperklasse om ruwe mm-metingen te filteren en te mappen naar %.
 
     Attributen (kern):
-    - `window`: buffer voor medianfilter
+    - `window`: ringbuffer (array 'f') voor medianfilter; grootte volgt `cfg["window"]`
     - `ema`: laatste geëxponentieel gewogen gemiddelde
-    - `obs_min`/`obs_max`: optionele auto-leer ankers
+    - `obs_min`/`obs_max`: auto-leer ankers (±inf zolang er niets is geobserveerd)
     - `state`: laatst besloten toestand
     - `last_pct`: laatst berekende percentage
+
+    Contract: de waarden uit `cfg` worden bij init en in `refresh_cfg()` naar
+    attributen gekopieerd; het samplepad leest `cfg` zelf niet. Wie `cfg` wijzigt
+    (kalibratie, CFG RESET, testmodus) moet daarna `refresh_cfg()` aanroepen,
+    anders blijven oude grenzen, alpha en hysterese van kracht.
     """
 
     def __init__(self, cfg):
         self.cfg = cfg
-        self.window = []
+        self.window = None
         self.ema = None
-        self.obs_min = None
-        self.obs_max = None
+        self.obs_min = _INF
+        self.obs_max = _NEG_INF
         self.state = STATE_FAULT
         self.last_pct = None
-
-    def _median(self, arr):
-        """Bereken de mediaan van een kleine lijst (copy/sort; n is klein)."""
-        a = sorted(arr)
-        n = len(a)
+        # Overgangsfuncties per huidige toestand (eenmalig opgebouwd)
+        self._transitions = {
+            STATE_OK: self._from_ok,
+            STATE_LOW: self._from_low,
+            STATE_BOTTOM: self._from_bottom,
+            STATE_FAULT: self._from_fault,
+        }
+        self.refresh_cfg()
+
+    def refresh_cfg(self):
+        """Neem configuratiewaarden over in attributen voor het samplepad.
+
+        Verplicht na elke wijziging van `cfg` (zie klasse-docstring). Bij een
+        gewijzigde `window`-grootte worden de buffers opnieuw aangemaakt.
+        """
+        cfg = self.cfg
+        self._min_mm = cfg["min_mm"]
+        self._max_mm = cfg["max_mm"]
+        self._alpha = cfg["ema_alpha"]
+        self._one_minus_alpha = 1.0 - self._alpha
+        self._cal_empty = cfg["cal_empty_mm"]
+        self._cal_full = cfg["cal_full_mm"]
+        self._auto_learn = cfg["cal_auto_learn"]
+        self._low = cfg["low_pct"]
+        self._bottom = cfg["bottom_pct"]
+        self._h = cfg["hysteresis_pct"]
+        # Hysterese-drempels voor decide_state (eenmalig per cfg-wijziging)
+        self._low_minus_h = self._low - self._h
+        self._low_plus_h = self._low + self._h
+        self._bot_minus_h = self._bottom - self._h
+        self._bot_plus_2h = self._bottom + self._h + self._h
+        # Kalibratie kan gewijzigd zijn: span opnieuw bepalen bij volgende sample
+        self._cal_dirty = True
+        n = max(3, int(cfg["window"]))
+        if self.window is None or len(self.window) != n:
+            # Nul-gevuld vanuit ruwe bytes: geen tijdelijke lijst met n float-objecten
+            self.window = array.array("f", bytes(4 * n))
+            self._sorted = array.array("f", bytes(4 * n))  # gevulde plaatsen, oplopend gesorteerd
+            self._head = 0   # volgende schrijfpositie in de ringbuffer
+            self._count = 0  # aantal gevulde plaatsen (<= len(window))
+
+    def _push(self, mm):
+        """Schrijf `mm` in de ringbuffer en houd `_sorted` bij zonder volledige sort.
+
+        Bij een volle buffer wordt de overschreven (oudste) waarde uit `_sorted`
+        verwijderd; daarna wordt de nieuwe waarde op zijn plek ingevoegd. Beide
+        stappen schuiven hooguit n elementen op, zonder allocatie.
+        """
+        w = self.window
+        s = self._sorted
+        n = len(w)
+        cnt = self._count
+        head = self._head
+        if cnt == n:
+            old = w[head]
+            i = 0
+            while i < cnt and s[i] != old:
+                i += 1
+            while i < cnt - 1:
+                s[i] = s[i + 1]
+                i += 1
+            cnt -= 1
+        w[head] = mm
+        v = w[head]  # float32-afgeronde waarde, zodat verwijderen later exact matcht
+        j = cnt - 1
+        while j >= 0 and s[j] > v:
+            s[j + 1] = s[j]
+            j -= 1
+        s[j + 1] = v
+        self._count = cnt + 1
+        self._head = (head + 1) % n
+
+    @micropython.native
+    def _median(self):
+        """Mediaan van de gevulde window-plaatsen; direct uit `_sorted` gelezen."""
+        n = self._count
         if n == 0:
             return None
+        a = self._sorted
         mid = n // 2
         return a[mid] if n % 2 == 1 else (a[mid - 1] + a[mid]) / 2
 
+    def _update_span(self):
+        """Bepaal effectieve leeg-waarde en schaal (100/span) uit kalibratie of obs_min/max.
+
+        Alleen nodig na een cfg-wijziging of een nieuw auto-leer anker; het
+        samplepad is daarna één affiene stap: (leeg - ema) * schaal.
+        """
+        empty_mm = self._cal_empty
+        if empty_mm is None:
+            empty_mm = self.obs_max if self.obs_max != _NEG_INF else self._max_mm
+        full_mm = self._cal_full
+        if full_mm is None:
+            full_mm = self.obs_min if self.obs_min != _INF else self._min_mm
+        self._empty_eff = float(empty_mm)
+        self._pct_scale = 100.0 / max(5.0, float(empty_mm - full_mm))
+        self._cal_dirty = False
+
+    @micropython.native
     def ingest_mm(self, mm):
         """Verwerk ruwe mm-invoer door de pijplijn en geef (ema_mm, pct) terug.
 
         Stappen: plausibiliteit → mediaan → EMA → percent mapping.
         Bij ontbrekende kalibratie-ankers valt de mapping terug op `obs_min/max`.
         """
-        if mm is None:
-            return None, None
-        if not (self.cfg["min_mm"] <= mm <= self.cfg["max_mm"]):
+        # Positieve range-check: NaN faalt hier ook (losse </> laten NaN door)
+        if mm is None or not (self._min_mm <= mm <= self._max_mm):
             return None, None
 
-        self.window.append(mm)
-        if len(self.window) > max(3, self.cfg["window"]):
-            self.window.pop(0)
-        med = self._median(self.window)
+        self._push(mm)
+        med = self._median()
         if med is None:
             return None, None
 
-        a = self.cfg["ema_alpha"]
-        self.ema = med if self.ema is None else (a * med + (1 - a) * self.ema)
+        # Attributen één keer naar locals: LOAD_FAST i.p.v. herhaalde LOAD_ATTR
+        ema = self.ema
+        ema = med if ema is None else self._alpha * med + self._one_minus_alpha * ema
+        self.ema = ema
 
-        if self.cfg["cal_auto_learn"]:
-            if (self.obs_min is None) or (self.ema < self.obs_min):
-                self.obs_min = self.ema
-            if (self.obs_max is None) or (self.ema > self.obs_max):
-                self.obs_max = self.ema
+        if self._auto_learn:
+            if ema < self.obs_min:
+                self.obs_min = ema
+                self._cal_dirty = True
+            if ema > self.obs_max:
+                self.obs_max = ema
+                self._cal_dirty = True
 
-        empty_mm = self.cfg["cal_empty_mm"] if self.cfg["cal_empty_mm"] is not None else (self.obs_max or self.cfg["max_mm"])
-        full_mm = self.cfg["cal_full_mm"] if self.cfg["cal_full_mm"] is not None else (self.obs_min or self.cfg["min_mm"])
-        span = max(5.0, float(empty_mm - full_mm))
-        pct = 100.0 * (empty_mm - float(self.ema)) / span
-        pct = clamp(pct, 0.0, 100.0)
+        if self._cal_dirty:
+            self._update_span()
+        pct = (self._empty_eff - float(ema)) * self._pct_scale
+        pct = 0.0 if pct < 0.0 else (100.0 if pct > 100.0 else pct)
 
         self.last_pct = pct
-        return self.ema, pct
+        return ema, pct
 
+    @micropython.native
     def decide_state(self):
         """Toestandsmachine met hysterese op basis van `last_pct`."""
         if self.last_pct is None:
             return STATE_FAULT
-        low = self.cfg["low_pct"]
-        bottom = self.cfg["bottom_pct"]
-        h = self.cfg["hysteresis_pct"]
-        cur = self.state
-        p = self.last_pct
-
-        if cur == STATE_FAULT:
-            if p <= bottom:
-                return STATE_BOTTOM
-            elif p <= low:
-                return STATE_LOW
-            else:
-                return STATE_OK
-
-        if cur == STATE_OK:
-            if p <= (low - h):
-                return STATE_LOW
-            return STATE_OK
+        return self._transitions.get(self.state, self._from_unknown)(self.last_pct)
+
+    def _from_fault(self, p):
+        if p <= self._bottom:
+            return STATE_BOTTOM
+        elif p <= self._low:
+            return STATE_LOW
+        return STATE_OK
 
-        if cur == STATE_LOW:
-            if p <= (bottom - h):
-                return STATE_BOTTOM
-            elif p >= (low + h):
-                return STATE_OK
+    def _from_ok(self, p):
+        if p <= self._low_minus_h:
             return STATE_LOW
+        return STATE_OK
 
-        if cur == STATE_BOTTOM:
-            if p >= (bottom + h + h):
-                return STATE_LOW if p <= (low - h) else STATE_OK
+    def _from_low(self, p):
+        if p <= self._bot_minus_h:
             return STATE_BOTTOM
+        elif p >= self._low_plus_h:
+            return STATE_OK
+        return STATE_LOW
+
+    def _from_bottom(self, p):
+        if p >= self._bot_plus_2h:
+            return STATE_LOW if p <= self._low_minus_h else STATE_OK
+        return STATE_BOTTOM
 
+    def _from_unknown(self, p):
         return STATE_FAULT
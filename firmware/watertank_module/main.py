@@ -10,36 +10,305 @@ Tip voor lezers: bekijk `water_module.py` voor de kernlogica en BLE-events.
 """
 
 from machine import Pin
-from water_module import WaterModule, log, DEFAULT_CONFIG
+from water_module import WaterModule, log, DEFAULT_CONFIG, json_literal
+import os
 import time
 import ujson
 
 # Global reference to the water module
 water_module = None
 
+# Gecachet (geëncodeerd) JSON-antwoord voor CFG?; op None zetten bij elke cfg-wijziging
+_cfg_json = None
+
+# Vast antwoord-template voor INFO?: alleen de waarden wisselen per poll
+_INFO_FMT = (
+    '{"pct": %s, "state": "%s", "ready": %s, "cal_empty_mm": %s, '
+    '"cal_full_mm": %s, "test_active": %s, "current_level_mm": %s, '
+    '"sensor_valid": %s}'
+)
+
+# Vaste antwoorden als bytes: notify stuurt ze zonder encode door
+_RESP_TEST_STARTED = b"Test mode started"
+_RESP_PIPE_STARTED = b"Pipeline test started"
+_RESP_PIPE_OUT_STARTED = b"Pipeline test with outputs started"
+_RESP_TEST_STOPPED = b"Test mode stopped"
+_RESP_TEST_FAST = b"Test period set to 8s"
+_RESP_CAL_SAVE_FAILED = b"Calibration set but failed to save config"
+_RESP_CAL_NO_SENSOR = b"Cannot calibrate: no valid sensor reading"
+_RESP_CAL_CLEARED = b"Calibration cleared"
+_RESP_CAL_CLEAR_SAVE_FAILED = b"Calibration cleared but failed to save config"
+_RESP_CFG_RESET_SAVE_FAILED = b"Configuration reset but failed to save"
+_RESP_NOT_INITIALIZED = b"Water module not initialized"
+
+# Laatst weggeschreven config-JSON; ongewijzigde inhoud niet opnieuw flashen
+_saved_cfg_json = None
+
+def _invalidate_cfg_cache():
+    """Markeer het gecachte CFG?-antwoord als verouderd."""
+    global _cfg_json
+    _cfg_json = None
+
 def save_config():
     """Save current water module configuration to persistent storage."""
-    global water_module
+    global water_module, _saved_cfg_json
     if not water_module:
         return False
+    # Elke opgeslagen wijziging kan CFG?-velden raken
+    _invalidate_cfg_cache()
     
+    path = water_module.cfg.get("persist_path", "config.json")
+    tmp = path + ".tmp"
     try:
-        with open(water_module.cfg.get("persist_path", "config.json"), "w") as f:
-            # Only save non-default values to keep the file clean
-            config_to_save = {}
-            for key, value in water_module.cfg.items():
-                if key in DEFAULT_CONFIG and DEFAULT_CONFIG[key] != value:
-                    config_to_save[key] = value
-                elif key not in DEFAULT_CONFIG:
-                    config_to_save[key] = value
-            
-            f.write(ujson.dumps(config_to_save, indent=2))
-        log("info", f"Configuration saved to {water_module.cfg.get('persist_path', 'config.json')}")
+        # Only save non-default values to keep the file clean
+        config_to_save = {}
+        for key, value in water_module.cfg.items():
+            if key in DEFAULT_CONFIG and DEFAULT_CONFIG[key] != value:
+                config_to_save[key] = value
+            elif key not in DEFAULT_CONFIG:
+                config_to_save[key] = value
+
+        data = ujson.dumps(config_to_save)
+        if _saved_cfg_json is None:
+            # Eerste save sinds boot: vergelijk met wat er al op flash staat
+            try:
+                with open(path) as f:
+                    _saved_cfg_json = f.read()
+            except Exception:
+                pass
+        if data == _saved_cfg_json:
+            log("info", f"Configuration unchanged, {path} not rewritten")
+            return True
+
+        # Schrijf naar een tijdelijk bestand en vervang in één rename, zodat een
+        # reset tijdens het schrijven nooit een half config.json achterlaat
+        with open(tmp, "w") as f:
+            f.write(data)
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Filesystems zonder rename-over: eerst oude versie verwijderen
+            try:
+                os.remove(path)
+                os.rename(tmp, path)
+            except Exception:
+                # Geen wees-tempbestand op flash achterlaten
+                try:
+                    os.remove(tmp)
+                except Exception:
+                    pass
+                raise
+        _saved_cfg_json = data
+        log("info", f"Configuration saved to {path}")
         return True
     except Exception as e:
         log("error", f"Failed to save config: {e}")
         return False
 
+def _cmd_test_start(wm):
+    wm.start_test(pipeline=False, allow_outputs=False)
+    return _RESP_TEST_STARTED
+
+def _cmd_test_start_pipe(wm):
+    wm.start_test(pipeline=True, allow_outputs=False)
+    return _RESP_PIPE_STARTED
+
+def _cmd_test_start_pipe_out(wm):
+    wm.start_test(pipeline=True, allow_outputs=True)
+    return _RESP_PIPE_OUT_STARTED
+
+def _cmd_test_stop(wm):
+    wm.stop_test()
+    return _RESP_TEST_STOPPED
+
+def _cmd_test_status(wm):
+    # Return JSON for consistency with other status commands
+    test_status = {
+        "test_active": wm.test_active,
+        "test_data_active": getattr(wm, 'test_data_active', False),
+        "test_pipeline": getattr(wm, 'test_pipeline', False),
+        "test_allow_outputs": getattr(wm, 'test_allow_outputs', False),
+        "test_data_id": getattr(wm, 'test_data_id', 0),
+        "test_period_s": wm.cfg.get("test_period_s", 20)
+    }
+    return ujson.dumps(test_status)
+
+def _apply_test_period(wm, val):
+    # Nieuwe sweep-periode: starttijd resetten zodat ze direct effect heeft,
+    # en meteen een sample sturen voor snelle feedback
+    wm.cfg["test_period_s"] = val
+    wm._refresh_loop_cfg()
+    _invalidate_cfg_cache()
+    wm.test_start_time = time.time()
+    try:
+        wm._last_test_ble_ms = 0
+        wm._generate_test_data(force_send=True)
+    except Exception:
+        pass
+
+def _cmd_test_period(wm, cmd):
+    # Dynamisch de sweep-periode aanpassen
+    try:
+        val = int(cmd.split()[-1])
+        if val < 2:
+            val = 2
+        if val > 120:
+            val = 120
+        _apply_test_period(wm, val)
+        return f"Test period set to {val}s"
+    except Exception as e:
+        return f"Invalid period: {e}"
+
+def _cmd_test_fast(wm):
+    _apply_test_period(wm, 8)
+    return _RESP_TEST_FAST
+
+def _cmd_info(wm):
+    # Retourneer statusinformatie als JSON (dashboard verwacht JSON).
+    # Tijdens test: gebruik test-niveau; anders echte sensor.
+    if wm.test_active and wm.test_level is not None:
+        # During test: use test level and state
+        pct = wm._update_level_state_from_level(wm.test_level)
+        current_level = wm.test_level
+        sensor_valid = True
+    else:
+        # Normal mode: use real sensor data
+        pct = wm._update_level_state()
+        current_level = wm.current_level if wm.sensor_valid else None
+        sensor_valid = bool(wm.sensor_valid)
+    
+    # Mask percentage when sensor is invalid to avoid fake 0%/100% flicker
+    pct_for_display = round(pct, 1) if sensor_valid else None
+    
+    return _INFO_FMT % (
+        json_literal(pct_for_display),
+        wm.current_state,
+        json_literal(wm.ready),
+        json_literal(wm.cfg.get("cal_empty_mm", 190.0)),
+        json_literal(wm.cfg.get("cal_full_mm", 50.0)),
+        json_literal(wm.test_active),
+        json_literal(current_level),
+        json_literal(sensor_valid),
+    )
+
+def _cmd_cfg(wm):
+    # Retourneer essentiële configuratie als JSON (dashboard verwacht JSON).
+    # Het antwoord wordt gecachet tot de configuratie wijzigt.
+    global _cfg_json
+    if _cfg_json is not None:
+        return _cfg_json
+    essential_cfg = {
+        "min_mm": wm.cfg.get("min_mm", 0),
+        "max_mm": wm.cfg.get("max_mm", 100),
+        "timeout_ms": wm.cfg.get("timeout_ms", 1000),
+        "sample_hz": wm.cfg.get("sample_hz", 10),
+        "hysteresis_pct": wm.cfg.get("hysteresis_pct", 5),
+        "low_pct": wm.cfg.get("low_pct", 20),
+        "bottom_pct": wm.cfg.get("bottom_pct", 5),
+        "ble_enabled": wm.cfg.get("ble_enabled", True),
+        "ble_name": wm.cfg.get("ble_name", "VBMCSWT")
+    }
+    # Direct als bytes bewaren: notify hoeft het antwoord dan niet te encoden
+    _cfg_json = ujson.dumps(essential_cfg).encode()
+    return _cfg_json
+
+def _cmd_cal_full(wm):
+    # Set current level as full calibration point
+    if wm.sensor_valid and wm.current_level is not None:
+        wm.cfg["cal_full_mm"] = wm.current_level
+        if save_config():
+            try:
+                # Push immediate status update so dashboard refreshes promptly
+                wm._send_status(force=True)
+            except Exception:
+                pass
+            return f"Full level calibrated to {wm.current_level:.1f}mm"
+        else:
+            return _RESP_CAL_SAVE_FAILED
+    else:
+        return _RESP_CAL_NO_SENSOR
+
+def _cmd_cal_empty(wm):
+    # Set current level as empty calibration point
+    if wm.sensor_valid and wm.current_level is not None:
+        wm.cfg["cal_empty_mm"] = wm.current_level
+        if save_config():
+            try:
+                wm._send_status(force=True)
+            except Exception:
+                pass
+            return f"Empty level calibrated to {wm.current_level:.1f}mm"
+        else:
+            return _RESP_CAL_SAVE_FAILED
+    else:
+        return _RESP_CAL_NO_SENSOR
+
+def _cmd_cal_clear(wm):
+    # Clear calibration values (reset to None/defaults)
+    wm.cfg["cal_full_mm"] = None
+    wm.cfg["cal_empty_mm"] = None
+    if save_config():
+        try:
+            wm._send_status(force=True)
+        except Exception:
+            pass
+        return _RESP_CAL_CLEARED
+    else:
+        return _RESP_CAL_CLEAR_SAVE_FAILED
+
+def _cmd_cfg_reset(wm):
+    # Reset configuration to defaults
+    try:
+        # Keep essential runtime state but reset config values
+        old_ble_name = wm.cfg.get("ble_name", "VBMCSWT")
+        wm.cfg.clear()
+        wm.cfg.update(DEFAULT_CONFIG.copy())
+        wm._refresh_loop_cfg()
+        _invalidate_cfg_cache()
+        
+        # Save the reset config
+        if save_config():
+            try:
+                wm._send_status(force=True)
+            except Exception:
+                pass
+            return f"Configuration reset to defaults (BLE name: {old_ble_name})"
+        else:
+            return _RESP_CFG_RESET_SAVE_FAILED
+    except Exception as e:
+        return f"Failed to reset config: {e}"
+
+# Vaste commando's → handler(wm); één dict-lookup i.p.v. een if/elif-keten
+_CMD_TABLE = {
+    "TEST START": _cmd_test_start,
+    "TEST START PIPE": _cmd_test_start_pipe,
+    "TEST START PIPE OUT": _cmd_test_start_pipe_out,
+    "TEST STOP": _cmd_test_stop,
+    "TEST?": _cmd_test_status,
+    "TEST FAST": _cmd_test_fast,
+    "INFO?": _cmd_info,
+    "CFG?": _cmd_cfg,
+    "CAL FULL": _cmd_cal_full,
+    "CAL EMPTY": _cmd_cal_empty,
+    "CAL CLEAR": _cmd_cal_clear,
+    "CFG RESET": _cmd_cfg_reset,
+}
+
+# Commando's met parameter: (prefix, handler(wm, cmd))
+_CMD_PREFIXES = (
+    ("TEST PERIOD ", _cmd_test_period),
+)
+
+# Langste geldige commando is ruim korter; langere invoer wordt afgekapt
+_CMD_MAX_LEN = 32
+
+def _normalize_cmd(cmd):
+    # Dashboard stuurt al hoofdletters: alleen kopiëren als er iets te veranderen valt
+    cmd = cmd.strip()
+    if len(cmd) > _CMD_MAX_LEN:
+        cmd = cmd[:_CMD_MAX_LEN]
+    return cmd if cmd.isupper() else cmd.upper()
+
 def handle_command(cmd):
     """Verwerk inkomende BLE-commando's.
 
@@ -49,6 +318,8 @@ def handle_command(cmd):
     - "TEST START PIPE OUT": pipeline test met vrijgave outputs (gevaarlijk; alleen testomgeving)
     - "TEST STOP": stopt testmodus
     - "TEST?": status van testmodus
+    - "TEST PERIOD <s>": zet de sweep-periode (2..120 s)
+    - "TEST FAST": sweep-periode 8 s
     - "INFO?": JSON met actuele status voor het dashboard
     - "CFG?": JSON met essentiële configuratie
     - "CAL FULL": kalibreer huidige niveau als 'vol'
@@ -58,169 +329,18 @@ def handle_command(cmd):
     """
     global water_module
     if not water_module:
-        return "Water module not initialized"
+        return _RESP_NOT_INITIALIZED
     
-    cmd = cmd.strip().upper()
+    cmd = _normalize_cmd(cmd)
     log("info", f"Received command: {cmd}")
     
-    if cmd == "TEST START":
-        water_module.start_test(pipeline=False, allow_outputs=False)
-        return "Test mode started"
-    elif cmd == "TEST START PIPE":
-        water_module.start_test(pipeline=True, allow_outputs=False)
-        return "Pipeline test started"
-    elif cmd == "TEST START PIPE OUT":
-        water_module.start_test(pipeline=True, allow_outputs=True)
-        return "Pipeline test with outputs started"
-    elif cmd == "TEST STOP":
-        water_module.stop_test()
-        return "Test mode stopped"
-    elif cmd == "TEST?":
-        # Return JSON for consistency with other status commands
-        test_status = {
-            "test_active": water_module.test_active,
-            "test_data_active": getattr(water_module, 'test_data_active', False),
-            "test_pipeline": getattr(water_module, 'test_pipeline', False),
-            "test_allow_outputs": getattr(water_module, 'test_allow_outputs', False),
-            "test_data_id": getattr(water_module, 'test_data_id', 0),
-            "test_period_s": water_module.cfg.get("test_period_s", 20)
-        }
-        return ujson.dumps(test_status)
-    elif cmd.startswith("TEST PERIOD "):
-        # Dynamisch de sweep-periode aanpassen
-        try:
-            val = int(cmd.split()[-1])
-            if val < 2:
-                val = 2
-            if val > 120:
-                val = 120
-            water_module.cfg["test_period_s"] = val
-            # Reset starttijd zodat de nieuwe periode direct effect heeft
-            water_module.test_start_time = time.time()
-            # Forceer snelle feedback
-            try:
-                water_module._last_test_ble_ms = 0
-                water_module._generate_test_data(force_send=True)
-            except Exception:
-                pass
-            return f"Test period set to {val}s"
-        except Exception as e:
-            return f"Invalid period: {e}"
-    elif cmd == "TEST FAST":
-        water_module.cfg["test_period_s"] = 8
-        water_module.test_start_time = time.time()
-        try:
-            water_module._last_test_ble_ms = 0
-            water_module._generate_test_data(force_send=True)
-        except Exception:
-            pass
-        return "Test period set to 8s"
-    elif cmd == "INFO?":
-        # Retourneer statusinformatie als JSON (dashboard verwacht JSON).
-        # Tijdens test: gebruik test-niveau; anders echte sensor.
-        if water_module.test_active and water_module.test_level is not None:
-            # During test: use test level and state
-            pct = water_module._update_level_state_from_level(water_module.test_level)
-            current_level = water_module.test_level
-            sensor_valid = True
-        else:
-            # Normal mode: use real sensor data
-            pct = water_module._update_level_state()
-            current_level = water_module.current_level if water_module.sensor_valid else None
-            sensor_valid = bool(water_module.sensor_valid)
-        
-        # Mask percentage when sensor is invalid to avoid fake 0%/100% flicker
-        pct_for_display = round(pct, 1) if sensor_valid else None
-        
-        import ujson
-        info_data = {
-            "pct": pct_for_display,
-            "state": water_module.current_state,
-            "ready": water_module.ready,
-            "cal_empty_mm": water_module.cfg.get("cal_empty_mm", 190.0),
-            "cal_full_mm": water_module.cfg.get("cal_full_mm", 50.0),
-            "test_active": water_module.test_active,
-            "current_level_mm": current_level,
-            "sensor_valid": sensor_valid
-        }
-        return ujson.dumps(info_data)
-    elif cmd == "CFG?":
-        # Retourneer essentiële configuratie als JSON (dashboard verwacht JSON).
-        import ujson
-        essential_cfg = {
-            "min_mm": water_module.cfg.get("min_mm", 0),
-            "max_mm": water_module.cfg.get("max_mm", 100),
-            "timeout_ms": water_module.cfg.get("timeout_ms", 1000),
-            "sample_hz": water_module.cfg.get("sample_hz", 10),
-            "hysteresis_pct": water_module.cfg.get("hysteresis_pct", 5),
-            "low_pct": water_module.cfg.get("low_pct", 20),
-            "bottom_pct": water_module.cfg.get("bottom_pct", 5),
-            "ble_enabled": water_module.cfg.get("ble_enabled", True),
-            "ble_name": water_module.cfg.get("ble_name", "VBMCSWT")
-        }
-        return ujson.dumps(essential_cfg)
-    elif cmd == "CAL FULL":
-        # Set current level as full calibration point
-        if water_module.sensor_valid and water_module.current_level is not None:
-            water_module.cfg["cal_full_mm"] = water_module.current_level
-            if save_config():
-                try:
-                    # Push immediate status update so dashboard refreshes promptly
-                    water_module._send_status()
-                except Exception:
-                    pass
-                return f"Full level calibrated to {water_module.current_level:.1f}mm"
-            else:
-                return "Calibration set but failed to save config"
-        else:
-            return "Cannot calibrate: no valid sensor reading"
-    elif cmd == "CAL EMPTY":
-        # Set current level as empty calibration point
-        if water_module.sensor_valid and water_module.current_level is not None:
-            water_module.cfg["cal_empty_mm"] = water_module.current_level
-            if save_config():
-                try:
-                    water_module._send_status()
-                except Exception:
-                    pass
-                return f"Empty level calibrated to {water_module.current_level:.1f}mm"
-            else:
-                return "Calibration set but failed to save config"
-        else:
-            return "Cannot calibrate: no valid sensor reading"
-    elif cmd == "CAL CLEAR":
-        # Clear calibration values (reset to None/defaults)
-        water_module.cfg["cal_full_mm"] = None
-        water_module.cfg["cal_empty_mm"] = None
-        if save_config():
-            try:
-                water_module._send_status()
-            except Exception:
-                pass
-            return "Calibration cleared"
-        else:
-            return "Calibration cleared but failed to save config"
-    elif cmd == "CFG RESET":
-        # Reset configuration to defaults
-        try:
-            # Keep essential runtime state but reset config values
-            old_ble_name = water_module.cfg.get("ble_name", "VBMCSWT")
-            water_module.cfg.clear()
-            water_module.cfg.update(DEFAULT_CONFIG.copy())
-            
-            # Save the reset config
-            if save_config():
-                try:
-                    water_module._send_status()
-                except Exception:
-                    pass
-                return f"Configuration reset to defaults (BLE name: {old_ble_name})"
-            else:
-                return "Configuration reset but failed to save"
-        except Exception as e:
-            return f"Failed to reset config: {e}"
-    else:
-        return f"Unknown command: {cmd}"
+    handler = _CMD_TABLE.get(cmd)
+    if handler is not None:
+        return handler(water_module)
+    for prefix, handler in _CMD_PREFIXES:
+        if cmd.startswith(prefix):
+            return handler(water_module, cmd)
+    return f"Unknown command: {cmd}"
 
 def main():
     """Start de module, bind de BLE-handler en ga de hoofdlus in."""
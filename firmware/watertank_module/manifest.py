@@ -0,0 +1,15 @@
+# Freeze-manifest voor een eigen MicroPython-build met de watertankmodules.
+#
+# Bevroren modules staan als bytecode in flash: geen parse/compile bij boot en
+# minder heapgebruik. `main.py` en `config.json` blijven op het bestandssysteem
+# zodat ze zonder nieuwe firmwarebuild aangepast kunnen worden.
+#
+# Gebruik (vanuit de MicroPython-broncode):
+#   make -C ports/esp32 BOARD=ESP32_GENERIC FROZEN_MANIFEST=/pad/naar/manifest.py
+
+include("$(PORT_DIR)/boards/manifest.py")
+
+module("dypa02yy.py")
+module("level_estimator.py")
+module("simple_ble.py")
+module("water_module.py")
@@ -3,8 +3,8 @@
 Overzicht
 ---------
 - Biedt een BLE peripheral die tekstregels ontvangt (RX) en notificaties verstuurt (TX).
-- RX: ontvangen bytes → UTF-8 decode → line framing op "\n" (CRLF toegestaan) →
-  aanroep van ``on_command(str)`` per complete regel.
+- RX: ontvangen bytes → line framing op "\n" (CRLF toegestaan) → UTF-8 decode per
+  complete regel → aanroep van ``on_command(str)``.
 - TX: berichten worden in een kleine queue geplaatst met coalescing en pacing;
   verzending gebeurt in chunks voor compatibiliteit met ATT/MTU.
 
@@ -16,14 +16,17 @@ Compatibiliteit
 
 Ontwerpkeuzes
 -------------
-- Line-based command interface met een RX-accumulator begrensd op ~512 tekens.
-- TX micro-queue (max 32 items) met drop-oudste bij overflow en lichte coalescing van kleine payloads.
-- Chunks van 18 bytes per ``gatts_notify`` voor conservatieve compatibiliteit.
-- Advertising met 128-bit NUS UUID en verkorte naam; interval ~500 ms.
+- Line-based command interface met een RX-accumulator (bytearray) begrensd op 512 bytes.
+- TX-ringbuffer (32 items) met drop-oudste bij overflow en lichte coalescing van kleine payloads.
+- Notify-chunks zo groot als de kleinste onderhandelde MTU toelaat (MTU - 3 per verbinding, minimaal 20 bytes),
+  zonder pauzes; bij volle stack-buffers (ENOMEM) wordt de rest via een timer herhaald.
+- Advertising met 128-bit NUS UUID en verkorte naam; interval instelbaar (standaard 500 ms)
+  en gepauzeerd zolang er een verbinding is.
  - Optionele rate limiter voor NOTIFY (``send_interval_ms``) om maximaal X ms tussen verzendingen te houden.
 """
 
 import time
+from collections import deque
 
 try:
     import bluetooth
@@ -35,6 +38,25 @@ try:
 except Exception:
     micropython = None
 
+# Scheduling-capaciteit verandert niet tijdens runtime: één keer opzoeken
+_schedule = getattr(micropython, "schedule", None)
+
+# Nordic UART Service UUID; de little-endian vorm voor advertising is constant
+# en wordt eenmalig bij import berekend.
+_NUS_UUID_STR = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
+_NUS_UUID_LE = bytes(reversed(bytes.fromhex(_NUS_UUID_STR.replace("-", ""))))
+
+# ATT-payload bij standaard-MTU (23 - 3 header); groter na MTU-exchange
+_ATT_MIN_PAYLOAD = 20
+# Voorkeurs-MTU die we de central aanbieden
+_PREFERRED_MTU = 247
+# errno van gatts_notify als de stack-buffers vol zijn
+_ENOMEM = 12
+
+# TX-ringbuffer: vaste capaciteit (macht van 2) zodat wrap een bitmask is
+_TXQ_SIZE = 32
+_TXQ_MASK = _TXQ_SIZE - 1
+
 
 class SimpleBLE:
     """Nordic-UART-achtige status/commandoservice voor eenvoudige tekst I/O.
@@ -47,31 +69,63 @@ class SimpleBLE:
 
     Belangrijke attributen:
     - ``name``: Apparatennaam voor GAP advertising.
-    - ``connections``: Set met actieve connection handles.
-    - ``_tx_queue``: Interne wachtrij met te verzenden bytestrings (max ``_queue_max`` items).
-    - ``_chunk_size``: Grootte van een notify-chunk (conservatief 18 bytes).
+    - ``connections``: Set met actieve connection handles (``_conn_tuple``: snapshot voor TX).
+    - ``_tx_buf``/``_tx_head``/``_tx_count``: TX-ringbuffer met te verzenden bytestrings
+      (max ``_TXQ_SIZE`` items, drop-oudste bij overflow).
+    - ``_conn_payload``: ATT-payload (MTU - 3) per connection handle; 20 tot MTU-exchange.
+    - ``_chunk_size``: Grootte van een notify-chunk: minimum van ``_conn_payload`` over de
+      actieve verbindingen (20 zonder verbindingen).
     - ``_rx_accum``: Accumulator voor inkomende data tot een newline ("\n") wordt gezien.
     """
 
-    def __init__(self, name="VBMCSWT", send_interval_ms=0):
+    def __init__(self, name="VBMCSWT", send_interval_ms=0, adv_interval_us=500_000):
         self.name = name
+        self._adv_interval_us = adv_interval_us
         # Optionele rate limiter voor NOTIFY: 0 = geen limiet
         try:
             self._send_interval_ms = max(0, int(send_interval_ms))
         except Exception:
             self._send_interval_ms = 0
+        # Tijdbron eenmalig kiezen i.p.v. try/except bij elke aanroep:
+        # ticks_ms (MicroPython) of time.time() voor omgevingen zonder ticks_ms
+        try:
+            self._now_ms = time.ticks_ms
+            self._diff_ms = time.ticks_diff
+        except Exception:
+            self._now_ms = lambda: int(time.time() * 1000)
+            self._diff_ms = lambda a, b: a - b
         self._last_send_ms = 0
-        self._rate_timer = None  # One-shot timer voor vertraagde drain
+        # One-shot timer voor vertraagde drain: eenmalig aanmaken en per keer
+        # opnieuw armeren (geen Timer-object of closure per rate-limit/ENOMEM)
+        try:
+            from machine import Timer
+            self._rate_timer = Timer(-1)
+            self._timer_one_shot = Timer.ONE_SHOT
+        except Exception:
+            self._rate_timer = None
+        self._cb_timer = self._rate_timer_cb
         self.ble = bluetooth.BLE()
         self.ble.active(True)
         try:
             self.ble.config(gap_name=self.name)
         except Exception:
             pass
+        try:
+            self.ble.config(mtu=_PREFERRED_MTU)
+        except Exception:
+            pass
+        # IRQ-dispatchtabel (event -> gebonden handler) eenmalig opbouwen,
+        # vóór registratie van de IRQ
+        self._irq_handlers = {
+            3: self._on_write,
+            1: self._on_connect,
+            2: self._on_disconnect,
+            21: self._on_mtu,
+        }
         self.ble.irq(self._irq)
 
         # Nordic UART Service UUIDs
-        self._UART_UUID_STR = "6E400001-B5A3-F393-E0A9-E50E24DCCA9E"
+        self._UART_UUID_STR = _NUS_UUID_STR
         UART_UUID = bluetooth.UUID(self._UART_UUID_STR)
         UART_TX = (bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E"), bluetooth.FLAG_NOTIFY)
         UART_RX = (bluetooth.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E"), bluetooth.FLAG_WRITE)
@@ -96,40 +150,36 @@ class SimpleBLE:
             self._tx_val_handle = service_handles
             self._rx_val_handle = None
         self.connections = set()
+        self._conn_tuple = ()          # snapshot van connections; alleen herbouwd bij (dis)connect
 
         # TX micro-queue & RX line framing
-        self._tx_queue = []            # lijst met bytes-payloads in FIFO volgorde
-        self._queue_max = 32           # max aantal wachtrij-items; drop oudste bij overflow
-        self._chunk_size = 18          # chunkgrootte voor gatts_notify (conservatief vs. MTU)
+        self._tx_buf = [None] * _TXQ_SIZE  # ringbuffer met bytes-payloads in FIFO volgorde
+        self._tx_head = 0              # index van het oudste item
+        self._tx_count = 0             # aantal items in de ring
+        self._conn_payload = {}        # conn_handle -> ATT-payload (MTU - 3) van die verbinding
+        self._chunk_size = _ATT_MIN_PAYLOAD  # chunkgrootte voor gatts_notify; kleinste live MTU
         self._draining = False         # vlag of drain-loop reeds gepland/actief is
-        self._rx_accum = ""            # buffer voor (deel)regels totdat een '\n' verschijnt
+        self._rx_accum = bytearray()   # ruwe bytes van (deel)regels totdat een '\n' verschijnt
 
-        # Ensure we start advertising immediately
-        self._start_adv()
+        # Callbacks voor micropython.schedule eenmalig binden: geen closure- of
+        # bound-method-allocatie per IRQ/drain (heap kan in IRQ-context op slot zitten)
+        self._cb_drain = self._sched_drain_once
+        self._cb_kick = self._sched_schedule_drain
+        self._cb_cmds = self._run_pending_commands
+        self._cmd_pending = deque((), 8)  # ontvangen regels die op dispatch wachten
+        self._cmd_scheduled = False
 
-    def _now_ms(self):
-        """Huidige tijd in milliseconden.
+        # Advertising payload is vast (naam + NUS UUID): eenmalig opbouwen en bij
+        # elke herstart van adverteren (b.v. na disconnect in IRQ) hergebruiken
+        self._adv = self._adv_payload(name=self.name, services=[self._UART_UUID_STR])
 
-        Probeert ``time.ticks_ms`` (MicroPython) en valt terug op ``int(time.time()*1000)``
-        voor omgevingen zonder ``ticks_ms``.
-        """
-        try:
-            return time.ticks_ms()
-        except Exception:
-            # Fallback for environments without ticks_ms
-            return int(time.time() * 1000)
-        
+        # Ensure we start advertising immediately
+        self._start_adv()
 
     def _uuid128_le(self, uuid_str):
         """Converteer UUID-string naar 128-bit little-endian bytes (voor advertising)."""
-        hexs = uuid_str.replace('-', '')
-        buf = bytearray()
-        for i in range(0, 32, 2):
-            buf.append(int(hexs[i:i+2], 16))
-        out = bytearray()
-        for i in range(len(buf) - 1, -1, -1):
-            out.append(buf[i])
-        return bytes(out)
+        # reversed() i.p.v. [::-1]: MicroPython ondersteunt geen slice-stap op bytes
+        return bytes(reversed(bytes.fromhex(uuid_str.replace('-', ''))))
 
     def _adv_payload(self, name=None, services=None):
         """Bouw advertising payload (max 31 bytes): flags + (optioneel) 128-bit services + naam.
@@ -146,7 +196,7 @@ class SimpleBLE:
             svc_bytes = bytearray()
             for u in services:
                 try:
-                    svc_bytes += self._uuid128_le(u)
+                    svc_bytes += _NUS_UUID_LE if u == _NUS_UUID_STR else self._uuid128_le(u)
                 except Exception:
                     continue
             if svc_bytes:
@@ -169,109 +219,167 @@ class SimpleBLE:
     def _start_adv(self):
         """Start (opnieuw) adverteren met NUS UUID en verkorte naam."""
         try:
-            adv = self._adv_payload(name=self.name, services=[self._UART_UUID_STR])
+            adv = self._adv
             try:
-                self.ble.gap_advertise(500_000, adv_data=adv, connectable=True)
+                self.ble.gap_advertise(self._adv_interval_us, adv_data=adv, connectable=True)
             except Exception:
-                self.ble.gap_advertise(500_000, adv_data=adv)
+                self.ble.gap_advertise(self._adv_interval_us, adv_data=adv)
         except Exception:
             pass
 
     def _schedule_drain_after(self, delay_ms):
-        """Plan een drain-iteratie na een vertraging met een one-shot timer indien beschikbaar."""
-        try:
-            from machine import Timer
-        except Exception:
+        """Plan een drain-iteratie na een vertraging met de one-shot timer indien beschikbaar."""
+        tmr = self._rate_timer
+        if tmr is None:
             return False
         try:
-            # Stop bestaande timer indien actief
-            if self._rate_timer is not None:
-                try:
-                    self._rate_timer.deinit()
-                except Exception:
-                    pass
-                self._rate_timer = None
-            self._rate_timer = Timer(-1)
-            def _tmr_cb(_):
-                try:
-                    if micropython and hasattr(micropython, "schedule"):
-                        def _run(_):
-                            self._schedule_drain()
-                        micropython.schedule(_run, 0)
-                    else:
-                        self._schedule_drain()
-                except Exception:
-                    pass
-                try:
-                    self._rate_timer.deinit()
-                except Exception:
-                    pass
-                self._rate_timer = None
-            self._rate_timer.init(period=max(1, int(delay_ms)), mode=Timer.ONE_SHOT, callback=_tmr_cb)
+            # init() op een lopende timer herstart hem met de nieuwe periode
+            tmr.init(period=max(1, int(delay_ms)), mode=self._timer_one_shot, callback=self._cb_timer)
             return True
         except Exception:
             return False
 
+    def _rate_timer_cb(self, _):
+        """Timer-callback (vast gebonden in ``__init__``): plan de drain buiten IRQ-context."""
+        try:
+            if _schedule is not None:
+                _schedule(self._cb_kick, 0)
+            else:
+                self._schedule_drain()
+        except Exception:
+            pass
+
     def _irq(self, event, data):
-        """BLE IRQ handler: connect (1), disconnect (2), write (3)."""
-        if event == 1:  # connect
-            conn_handle, _, _ = data
-            self.connections.add(conn_handle)
-        elif event == 2:  # disconnect
-            conn_handle, _, _ = data
-            self.connections.discard(conn_handle)
-            self._start_adv()
-        elif event == 3:  # write
-            conn_handle, value_handle = data
-            if value_handle == self._rx_val_handle:
-                try:
-                    raw = self.ble.gatts_read(value_handle)
-                except Exception:
-                    raw = None
-                if not raw:
-                    return
-                # Accumulate and frame by lines (\n). Tolerate CRLF.
-                try:
-                    self._rx_accum += raw.decode('utf-8', 'ignore')
-                except Exception:
-                    return
-                # bound buffer to avoid unbounded growth
-                if len(self._rx_accum) > 512:
-                    self._rx_accum = self._rx_accum[-512:]
-                while True:
-                    nl = self._rx_accum.find('\n')
-                    if nl < 0:
-                        break
-                    line = self._rx_accum[:nl]
-                    self._rx_accum = self._rx_accum[nl+1:]
-                    cmd_txt = line.replace('\r', '').strip()
-                    if not cmd_txt:
-                        continue
-                    if micropython and hasattr(micropython, "schedule"):
-                        # Use a scheduled callback with required single-arg signature
-                        def _run_cmd_cb(_):
-                            try:
-                                response = self.on_command(cmd_txt)
-                                if response:
-                                    self.notify(response)
-                            except Exception:
-                                pass
-                        try:
-                            micropython.schedule(_run_cmd_cb, 0)
-                        except Exception:
-                            try:
-                                response = self.on_command(cmd_txt)
-                                if response:
-                                    self.notify(response)
-                            except Exception:
-                                pass
-                    else:
-                        try:
-                            response = self.on_command(cmd_txt)
-                            if response:
-                                self.notify(response)
-                        except Exception:
-                            pass
+        """BLE IRQ handler: connect (1), disconnect (2), write (3), MTU exchanged (21).
+
+        Dispatch via een vooraf gebouwde tabel met gebonden handlers; onbekende
+        events worden genegeerd.
+        """
+        h = self._irq_handlers.get(event)
+        if h is not None:
+            h(data)
+
+    def _on_connect(self, data):
+        conn_handle, _, _ = data
+        self.connections.add(conn_handle)
+        self._conn_tuple = tuple(self.connections)
+        # Standaard-MTU tot deze central een MTU-exchange doet
+        self._conn_payload[conn_handle] = _ATT_MIN_PAYLOAD
+        self._update_chunk_size()
+        # Niet adverteren tijdens een verbinding (radio/stroom); hervat bij disconnect
+        try:
+            self.ble.gap_advertise(None)
+        except Exception:
+            pass
+
+    def _on_disconnect(self, data):
+        conn_handle, _, _ = data
+        self._drop_conn(conn_handle)
+        self._start_adv()
+
+    def _on_mtu(self, data):
+        conn_handle, mtu = data
+        payload = max(_ATT_MIN_PAYLOAD, mtu - 3)
+        self._conn_payload[conn_handle] = payload
+        self._update_chunk_size()
+        # Grotere writes (commando's) in één keer kunnen ontvangen; de RX-buffer
+        # is gedeeld, dus afstemmen op de grootste live MTU
+        try:
+            if self._rx_val_handle is not None:
+                self.ble.gatts_set_buffer(self._rx_val_handle, max(self._conn_payload.values()))
+        except Exception:
+            pass
+
+    def _drop_conn(self, conn_handle):
+        """Verwijder een verbinding uit de administratie en herbereken de chunkgrootte."""
+        self.connections.discard(conn_handle)
+        self._conn_tuple = tuple(self.connections)
+        self._conn_payload.pop(conn_handle, None)
+        self._update_chunk_size()
+
+    def _update_chunk_size(self):
+        """Zet ``_chunk_size`` op de kleinste ATT-payload van de live verbindingen.
+
+        Eén notify moet voor elke central passen; zonder verbindingen 20 bytes.
+        """
+        sizes = self._conn_payload
+        self._chunk_size = min(sizes.values()) if sizes else _ATT_MIN_PAYLOAD
+
+    def _on_write(self, data):
+        conn_handle, value_handle = data
+        if value_handle != self._rx_val_handle:
+            return
+        try:
+            raw = self.ble.gatts_read(value_handle)
+        except Exception:
+            raw = None
+        if not raw:
+            return
+        # Accumulate and frame by lines (\n). Tolerate CRLF.
+        # Eerdere newlines zijn al verwerkt: alleen `raw` hoeft gescand te
+        # worden; regels worden pas na het afsplitsen gedecodeerd.
+        acc = self._rx_accum
+        base = len(acc)
+        acc.extend(raw)
+        nl = raw.find(b'\n')
+        if nl < 0:
+            # Deelregel (meest voorkomende fragment): alleen bufferen en begrenzen
+            if base + len(raw) > 512:
+                acc[:base + len(raw) - 512] = b''
+            return
+        start = 0
+        while nl >= 0:
+            end = base + nl
+            line = acc[start:end]
+            start = end + 1
+            nl = raw.find(b'\n', nl + 1)
+            try:
+                cmd_txt = line.decode('utf-8', 'ignore').replace('\r', '').strip()
+            except Exception:
+                continue
+            if not cmd_txt:
+                continue
+            if _schedule is not None:
+                # Buiten IRQ-context afhandelen via de wachtrij
+                self._cmd_pending.append(cmd_txt)
+            else:
+                self._dispatch_command(cmd_txt)
+        if self._cmd_pending and not self._cmd_scheduled:
+            try:
+                _schedule(self._cb_cmds, 0)
+                self._cmd_scheduled = True
+            except Exception:
+                self._run_pending_commands(None)
+        # Verwerkte regels in één keer verwijderen (slice-assign: één memmove)
+        if start:
+            acc[:start] = b''
+        # bound buffer to avoid unbounded growth
+        if len(acc) > 512:
+            acc[:len(acc) - 512] = b''
+
+    def _dispatch_command(self, cmd_txt):
+        """Voer één commando uit en queue een eventueel antwoord voor TX."""
+        try:
+            response = self.on_command(cmd_txt)
+            if response:
+                self.notify(response)
+        except Exception:
+            pass
+
+    def _run_pending_commands(self, _):
+        """Scheduled callback: handel alle wachtende commandoregels af (FIFO)."""
+        self._cmd_scheduled = False
+        q = self._cmd_pending
+        while q:
+            self._dispatch_command(q.popleft())
+
+    def _sched_drain_once(self, _):
+        """Scheduled callback (vast gebonden in ``__init__``) voor ``_drain_once``."""
+        self._drain_once()
+
+    def _sched_schedule_drain(self, _):
+        """Scheduled callback (vast gebonden in ``__init__``) voor ``_schedule_drain``."""
+        self._schedule_drain()
 
     def on_command(self, cmd):
         """Te overschrijven callback: verwerk één tekstregel als commando en
@@ -280,53 +388,88 @@ class SimpleBLE:
         pass
 
     def notify(self, text):
-        """Queueer een bericht voor TX via NOTIFY met coalescing en pacing."""
+        """Queueer een bericht voor TX via NOTIFY met coalescing en pacing.
+
+        De payload wordt hier één keer naar bytes gezet en daarna ongewijzigd
+        naar alle verbindingen gestuurd.
+        """
         if text is None:
             return
-        data = text if isinstance(text, bytes) else text.encode()
-        # Coalesce small payloads by appending when last item is small
-        if self._tx_queue and (len(self._tx_queue[-1]) + len(data) <= 240):
-            self._tx_queue[-1] += data
+        if isinstance(text, bytes):
+            data = text
+        elif isinstance(text, bytearray):
+            data = bytes(text)  # kopie: queue-items worden bij coalescing uitgebreid
         else:
-            self._tx_queue.append(data)
-        # Prevent unbounded growth
-        while len(self._tx_queue) > self._queue_max:
-            try:
-                self._tx_queue.pop(0)
-            except Exception:
-                break
+            data = text.encode()
+        buf = self._tx_buf
+        count = self._tx_count
+        # Coalesce small payloads by appending when last item is small
+        if count:
+            last = (self._tx_head + count - 1) & _TXQ_MASK
+            item = buf[last]
+            if len(item) + len(data) <= 240:
+                # Eenmalig omzetten naar een eigen bytearray; verdere coalescing
+                # breidt die in-place uit i.p.v. telkens bytes te kopiëren
+                if not isinstance(item, bytearray):
+                    item = buf[last] = bytearray(item)
+                item.extend(data)
+                self._schedule_drain()
+                return
+        # Volle ring: oudste item laten vallen (begrensde groei)
+        if count == _TXQ_SIZE:
+            self._txq_pop()
+            count -= 1
+        buf[(self._tx_head + count) & _TXQ_MASK] = data
+        self._tx_count = count + 1
         self._schedule_drain()
 
     def notify_priority(self, text):
         """Plaats bericht vooraan in de queue en start direct met verzenden."""
         if text is None:
             return
-        data = text if isinstance(text, bytes) else text.encode()
-        self._tx_queue.insert(0, data)
-        while len(self._tx_queue) > self._queue_max:
-            try:
-                self._tx_queue.pop(1 if len(self._tx_queue) > 1 else 0)
-            except Exception:
-                break
+        if isinstance(text, bytes):
+            data = text
+        elif isinstance(text, bytearray):
+            data = bytes(text)  # kopie: queue-items worden bij coalescing uitgebreid
+        else:
+            data = text.encode()
+        self._txq_push_front(data)
         self._schedule_drain()
 
+    def _txq_push_front(self, data):
+        """Zet ``data`` vooraan in de TX-ring; bij een volle ring vervangt het het oudste item."""
+        if self._tx_count == _TXQ_SIZE:
+            self._tx_buf[self._tx_head] = data
+        else:
+            self._tx_head = (self._tx_head - 1) & _TXQ_MASK
+            self._tx_buf[self._tx_head] = data
+            self._tx_count += 1
+
+    def _txq_pop(self):
+        """Haal het oudste item uit de TX-ring (aanroeper controleert ``_tx_count``)."""
+        head = self._tx_head
+        data = self._tx_buf[head]
+        self._tx_buf[head] = None
+        self._tx_head = (head + 1) & _TXQ_MASK
+        self._tx_count -= 1
+        return data
+
     def clear_tx_backlog(self):
         """Leeg de TX-wachtrij onmiddellijk om verouderde berichten te droppen."""
-        try:
-            self._tx_queue = []
-        except Exception:
-            pass
+        buf = self._tx_buf
+        for i in range(_TXQ_SIZE):
+            buf[i] = None
+        self._tx_head = 0
+        self._tx_count = 0
 
     def _schedule_drain(self):
         """Plan de drain-actie als deze nog niet actief is (eventueel met scheduling)."""
         if self._draining:
             return
         self._draining = True
-        if micropython and hasattr(micropython, "schedule"):
+        if _schedule is not None:
             try:
-                def _drain_cb(_):
-                    self._drain_once()
-                micropython.schedule(_drain_cb, 0)
+                _schedule(self._cb_drain, 0)
                 return
             except Exception:
                 pass
@@ -339,12 +482,10 @@ class SimpleBLE:
         Zonder verbindingen wordt backlog gereduceerd tot het laatste item om geheugen te sparen.
         """
         # Respecteer optionele verzend-interval (rate limit)
-        if self._send_interval_ms and self._tx_queue:
-            now_ms = self._now_ms()
-            try:
-                elapsed = (now_ms - self._last_send_ms) if self._last_send_ms else self._send_interval_ms
-            except Exception:
-                elapsed = self._send_interval_ms
+        if self._send_interval_ms and self._tx_count:
+            # ticks_diff: correct over de wrap-around van ticks_ms heen
+            last = self._last_send_ms
+            elapsed = self._diff_ms(self._now_ms(), last) if last else self._send_interval_ms
             if elapsed < self._send_interval_ms:
                 remaining = self._send_interval_ms - elapsed
                 # Stop huidige drain en plan later opnieuw
@@ -353,49 +494,71 @@ class SimpleBLE:
                     # Zonder timer geen busy-wait doen; volgende notify triggert opnieuw
                     pass
                 return
+        retry = None
         try:
             # If no connections, drop old backlog but keep latest
             if not self.connections:
-                if len(self._tx_queue) > 1:
-                    self._tx_queue = self._tx_queue[-1:]
+                while self._tx_count > 1:
+                    self._txq_pop()
                 self._draining = False
                 return
-            if not self._tx_queue:
+            if not self._tx_count:
                 self._draining = False
                 return
             # Pop one payload and (light) coalesce next small one
-            payload = self._tx_queue.pop(0)
-            if self._tx_queue and len(payload) < 64 and (len(payload) + len(self._tx_queue[0]) <= 240):
-                try:
-                    payload += self._tx_queue.pop(0)
-                except Exception:
-                    pass
-            # Send to all connections in chunks
-            for c in list(self.connections):
-                try:
-                    for i in range(0, len(payload), self._chunk_size):
-                        self.ble.gatts_notify(c, self._tx_val_handle, payload[i:i+self._chunk_size])
-                        try:
-                            time.sleep_ms(5)
-                        except Exception:
-                            pass
-                except Exception:
+            payload = self._txq_pop()
+            if self._tx_count and len(payload) < 64 and (len(payload) + len(self._tx_buf[self._tx_head]) <= 240):
+                if not isinstance(payload, bytearray):
+                    payload = bytearray(payload)
+                payload.extend(self._txq_pop())
+            # Send to all connections in MTU-sized chunks (meestal één notify)
+            chunk = self._chunk_size
+            n = len(payload)
+            # Past het in één notify, stuur dan het object zelf; anders zero-copy
+            # memoryview-slices i.p.v. een bytes-kopie per chunk
+            mv = memoryview(payload) if n > chunk else None
+            # Fan-out per chunk: chunk i gaat naar alle verbindingen vóór chunk i+1,
+            # zodat een trage of weggevallen verbinding de andere niet ophoudt
+            conns = self._conn_tuple
+            gatts_notify = self.ble.gatts_notify  # locals: geen attribuut-lookups per chunk
+            handle = self._tx_val_handle
+            i = 0
+            while i < n and conns:
+                part = payload if mv is None else mv[i:i + chunk]
+                for c in conns:
                     try:
-                        self.connections.remove(c)
+                        gatts_notify(c, handle, part)
+                    except OSError as e:
+                        if e.args and e.args[0] == _ENOMEM:
+                            # Stack-buffers vol: rest opnieuw aanbieden i.p.v. te slapen
+                            if len(self._conn_tuple) == 1:
+                                retry = payload[i:]
+                            else:
+                                # Deze verbinding mist nu een chunk: rest van payload overslaan
+                                conns = tuple(x for x in conns if x != c)
+                        else:
+                            self._drop_conn(c)
+                            conns = tuple(x for x in conns if x != c)
                     except Exception:
-                        pass
-            # Update laatst verzonden tijdstip na succesvolle verzending
-            try:
+                        self._drop_conn(c)
+                        conns = tuple(x for x in conns if x != c)
+                if retry is not None:
+                    break
+                i += chunk
+            # Update laatst verzonden tijdstip na succesvolle verzending; bij een
+            # ENOMEM-rest niet, anders houdt de rate limiter de rest ~interval vast
+            if retry is None:
                 self._last_send_ms = self._now_ms()
-            except Exception:
-                self._last_send_ms = 0
         finally:
-            # Reschedule if queue still has data
-            if self._tx_queue and (micropython and hasattr(micropython, "schedule")):
+            if retry is not None:
+                # Backpressure via timer: rest vooraan terugzetten en kort wachten
+                self._txq_push_front(retry)
+                self._draining = False
+                self._schedule_drain_after(5)
+            # Reschedule if queue still has data (zonder verbindingen: wachten op connect/notify)
+            elif self._draining and self._tx_count and _schedule is not None:
                 try:
-                    def _drain_cb2(_):
-                        self._drain_once()
-                    micropython.schedule(_drain_cb2, 0)
+                    _schedule(self._cb_drain, 0)
                 except Exception:
                     # Fallback immediate to avoid stall
                     self._drain_once()
@@ -46,18 +46,15 @@ import os
 from machine import UART, Pin
 import math
 import gc
+import micropython
+from collections import deque
 try:
     import random
 except Exception:
     random = None
 
-try:
-    import bluetooth
-except ImportError:
-    bluetooth = None
-
 # Direct imports
-from dypa02yy import DYPA02YY
+from dypa02yy import DYPA02YY, parse_mm_tenths, PARSE_OUT_OF_RANGE
 from level_estimator import (
     LevelEstimator,
     STATE_OK,
@@ -65,7 +62,6 @@ from level_estimator import (
     STATE_BOTTOM,
     STATE_FAULT,
 )
-from simple_ble import SimpleBLE
 
 # Configuration
 # Belangrijkste veiligheidsrelevante opties:
@@ -107,6 +103,8 @@ DEFAULT_CONFIG = {
     "log_level": "info",
     # BLE
     "ble_send_interval_ms": 1000,
+    "ble_adv_interval_ms": 500,
+    "ble_status_keepalive_ms": 30000,
     "persist_path": "config.json",
     "boot_grace_s": 3,
     "test_period_s": 20,
@@ -123,6 +121,8 @@ DEFAULT_CONFIG = {
 }
 
 LOG_LEVELS = {"err": 0, "error": 0, "warn": 1, "info": 2}
+# Voorgeformatteerde prefixen zodat log() niet per regel upper()/f-string doet
+_LOG_PREFIX = {k: "[" + k.upper() + "]" for k in LOG_LEVELS}
 _LOG_LEVEL = LOG_LEVELS.get(DEFAULT_CONFIG.get("log_level", "info"), 2)
 
 def set_log_level(level):
@@ -136,7 +136,35 @@ def set_log_level(level):
 def log(level, msg):
     """Print een genormeerde logregel indien toegestaan door het ingestelde niveau."""
     if LOG_LEVELS.get(level, 2) <= _LOG_LEVEL:
-        print(f"[{level.upper()}] {msg}")
+        print(_LOG_PREFIX.get(level) or "[" + level.upper() + "]", msg)
+
+# Vaste statusberichten als template: geen dict + generieke JSON-encoder per
+# notify. Volgorde en sleutels gelijk aan wat het dashboard verwacht.
+_STATUS_FMT = (
+    '{"seq": %d, "ts_ms": %d, "state": "%s", "pct": %s, "ready": %s, '
+    '"test_active": %s, "current_level_mm": %s, "last_sensor_time": %s, '
+    '"ema_mm": %s, "obs_min": %s, "obs_max": %s, "sensor_valid": %s, '
+    '"DEBUG_test_level": %s, "DEBUG_current_level": %s, '
+    '"DEBUG_sensor_valid": %s, "DEBUG_test_data_active": %s}'
+)
+_TEST_FMT = (
+    '{"seq": %d, "ts_ms": %d, "state": "%s", "pct": %s, "ready": %s, '
+    '"test_active": true, "current_level_mm": %s, "last_sensor_time": %s, '
+    '"ema_mm": %s, "obs_min": %s, "obs_max": %s, "evt": "test", '
+    '"test_data_id": %d, "test_elapsed": %s, "test_period": %s, '
+    '"DEBUG_test_level": %s, "DEBUG_current_level": %s, '
+    '"DEBUG_sensor_valid": %s, "DEBUG_test_data_active": %s}'
+)
+
+def json_literal(v):
+    """JSON-literal voor een scalair statusveld (None, bool of getal)."""
+    if v is None:
+        return "null"
+    if v is True:
+        return "true"
+    if v is False:
+        return "false"
+    return str(v)
 
 def load_config():
     """Laad configuratie uit `persist_path` en merge deze met `DEFAULT_CONFIG`.
@@ -171,6 +199,10 @@ def load_config():
         merged["wdt_enabled"] = bool(merged.get("wdt_enabled", True))
         # BLE rate limiter niet-negatief
         merged["ble_send_interval_ms"] = max(0, int(merged.get("ble_send_interval_ms", 1000)))
+        # Advertising-interval binnen de BLE-grenzen (20 ms .. 10.24 s)
+        merged["ble_adv_interval_ms"] = min(10240, max(20, int(merged.get("ble_adv_interval_ms", 500))))
+        # Keepalive voor ongewijzigde status; 0 = elke seconde volledig verzenden
+        merged["ble_status_keepalive_ms"] = max(0, int(merged.get("ble_status_keepalive_ms", 30000)))
         # Clamp test injectie parameters
         def _clampf(v, a, b, d):
             try:
@@ -212,11 +244,14 @@ class WaterModule:
             set_log_level(self.cfg.get("log_level", "info"))
         except Exception:
             pass
+        self._refresh_loop_cfg()
         
         # Initialize components
         self._init_pins()
         self._init_uart()
-        if self.cfg["ble_enabled"] and bluetooth:
+        # BLE-stack (bluetooth + simple_ble) alleen laden als BLE aan staat
+        self.ble = None
+        if self.cfg["ble_enabled"]:
             self._init_ble()
         
         # State variables
@@ -241,17 +276,31 @@ class WaterModule:
         except Exception:
             self._now_ms = lambda: int(time.time() * 1000)
             self._diff_ms = lambda a, b: a - b
+        # Boot-grace en sensor-timeout op ticks (int) i.p.v. time.time() (float)
+        self._boot_ms = self._now_ms()
+        self._last_sensor_ms = None
         self._last_test_ble_ms = 0
         self._last_status_ms = 0
+        # Delta-push: sleutel en tijdstip van de laatst verzonden status
+        self._last_status_key = None
+        self._last_status_sent_ms = 0
         self._last_sys_err_ms = 0
         self.test_pct = None
         self.seq = 0
         self.ema_level = None
         self._uart_buf = b""
+        # Vaste ontvangstbuffer voor uart.readinto(): geen nieuw bytes-object per read
+        try:
+            rx_size = max(64, int(self.cfg.get("uart_buf_max", 256)))
+        except Exception:
+            rx_size = 256
+        self._rx_buf = bytearray(rx_size)
+        self._rx_mv = memoryview(self._rx_buf)
         self._sensor_fail_count = 0
         self._sensor_fail_threshold = 3
-        # Test injectie queue voor UART-bytes (simulatie van chunking)
-        self._test_inject_queue = []
+        # Test injectie queue voor UART-bytes (simulatie van chunking); begrensde
+        # deque zodat popleft O(1) is en de queue niet onbeperkt kan groeien
+        self._test_inject_queue = deque((), 64)
         # State hysteresis/debounce
         self._pending_state = self.current_state
         self._pending_since_ms = self._now_ms()
@@ -259,10 +308,16 @@ class WaterModule:
 
         # Optional hardware watchdog
         self._wdt = None
+        # Voeden op een kwart van de timeout i.p.v. elke lus-iteratie; blijft in de
+        # hoofdlus zodat een vastgelopen lus nog steeds tot een reset leidt
+        self._wdt_feed_ms = 2000
+        self._last_wdt_feed_ms = self._now_ms()
         if self.cfg.get("wdt_enabled", True):
             try:
                 from machine import WDT
-                self._wdt = WDT(timeout=int(self.cfg.get("wdt_timeout_ms", 8000)))
+                wdt_timeout_ms = int(self.cfg.get("wdt_timeout_ms", 8000))
+                self._wdt = WDT(timeout=wdt_timeout_ms)
+                self._wdt_feed_ms = max(100, wdt_timeout_ms // 4)
                 log("info", "Hardware watchdog enabled")
             except Exception as _:
                 self._wdt = None
@@ -329,21 +384,48 @@ class WaterModule:
     
     def _init_ble(self):
         """Initialiseer de eenvoudige BLE-service en start adverteren."""
+        try:
+            from simple_ble import SimpleBLE, bluetooth
+        except Exception:
+            bluetooth = None
+        if bluetooth is None:
+            log("warn", "BLE not available on this build")
+            return
         try:
             # Respecteer optionele BLE rate limit voor NOTIFY's (ble_send_interval_ms)
-            self.ble = SimpleBLE(self.cfg["ble_name"], send_interval_ms=int(self.cfg.get("ble_send_interval_ms", 1000)))
+            self.ble = SimpleBLE(
+                self.cfg["ble_name"],
+                send_interval_ms=int(self.cfg.get("ble_send_interval_ms", 1000)),
+                adv_interval_us=int(self.cfg.get("ble_adv_interval_ms", 500)) * 1000,
+            )
             log("info", f"BLE initialized with name: {self.cfg['ble_name']}")
         except Exception as e:
             log("error", f"BLE initialization failed: {e}")
             self.ble = None
     
+    def _refresh_loop_cfg(self):
+        """Neem cfg-waarden voor de hoofdlus over in attributen.
+
+        Aanroepen na elke wijziging van `cfg` (CFG RESET, TEST PERIOD), zodat
+        de lus per tick geen dict-lookups, casts of vermenigvuldigingen doet.
+        """
+        cfg = self.cfg
+        self._loop_sleep_s = 1.0 / cfg["sample_hz"]
+        try:
+            self._timeout_ms = int(cfg.get("timeout_ms", 1200))
+        except Exception:
+            self._timeout_ms = 1200
+        self._boot_grace_ms = cfg["boot_grace_s"] * 1000
+        period = cfg["test_period_s"]
+        self._test_period_s = period if period > 0 else 20
+
     def _check_ready(self):
         """Zet `ready=True` zodra de boot-grace-periode verstreken is.
 
         Bij overgang naar `ready=True` wordt meteen `_apply_fail_safe_outputs()`
         aangeroepen zodat de actuele (gegate) uitgangsstaten worden toegepast.
         """
-        if not self.ready and (time.time() - self.boot_time) >= self.cfg["boot_grace_s"]:
+        if not self.ready and self._diff_ms(self._now_ms(), self._boot_ms) >= self._boot_grace_ms:
             self.ready = True
             log("info", "System ready")
             # Apply outputs upon becoming ready (gated logic inside will decide)
@@ -359,17 +441,20 @@ class WaterModule:
         Debounce is configureerbaar via `debounce_ms` en versnelt fail-safe zonder
         te veel jitter te introduceren.
         """
+        # Eén pass met locals: attributen en cfg één keer lezen, EMA één keer terugschrijven
+        cfg = self.cfg
+        valid = self.sensor_valid
+        level = self.current_level
+        ema = self.ema_level
         # Apply EMA to current_level when valid
-        if self.sensor_valid:
-            alpha = float(self.cfg.get("ema_alpha", 0.25))
-            if self.ema_level is None:
-                self.ema_level = self.current_level
-            else:
-                self.ema_level = alpha * self.current_level + (1.0 - alpha) * self.ema_level
-        level_for_state = self.ema_level if (self.sensor_valid and self.ema_level is not None) else self.current_level
-        if self.cfg["cal_full_mm"] and self.cfg["cal_empty_mm"] and level_for_state is not None:
-            full_mm = self.cfg["cal_full_mm"]
-            empty_mm = self.cfg["cal_empty_mm"]
+        if valid:
+            alpha = float(cfg.get("ema_alpha", 0.25))
+            ema = level if ema is None else alpha * level + (1.0 - alpha) * ema
+            self.ema_level = ema
+        level_for_state = ema if (valid and ema is not None) else level
+        full_mm = cfg["cal_full_mm"]
+        empty_mm = cfg["cal_empty_mm"]
+        if full_mm and empty_mm and level_for_state is not None:
             if full_mm < empty_mm:
                 pct = max(0, min(100, (empty_mm - level_for_state) / (empty_mm - full_mm) * 100))
             else:
@@ -378,18 +463,18 @@ class WaterModule:
             pct = 50.0
         
         # Hysteresis and debounce
-        hyst = float(self.cfg.get("hysteresis_pct", 4))
+        hyst = float(cfg.get("hysteresis_pct", 4))
         desired = self._decide_state_with_hysteresis(pct, hyst)
         now_ms = self._now_ms()
-        if desired != self._pending_state:
+        if desired is not self._pending_state:
             self._pending_state = desired
             self._pending_since_ms = now_ms
-        debounce_ms = int(self.cfg.get("debounce_ms", 200))
-        if self._diff_ms(now_ms, self._pending_since_ms) >= debounce_ms and desired != self.current_state:
-            old_state = self.current_state
+        debounce_ms = int(cfg.get("debounce_ms", 200))
+        old_state = self.current_state
+        if desired is not old_state and self._diff_ms(now_ms, self._pending_since_ms) >= debounce_ms:
             self.current_state = desired
             self._last_committed_state = desired
-            log("info", f"State changed: {old_state} -> {self.current_state} (pct: {pct:.1f}%)")
+            log("info", f"State changed: {old_state} -> {desired} (pct: {pct:.1f}%)")
             self._apply_fail_safe_outputs()
         
         return pct
@@ -420,11 +505,11 @@ class WaterModule:
         hyst = float(self.cfg.get("hysteresis_pct", 4))
         desired = self._decide_state_with_hysteresis(pct, hyst)
         now_ms = self._now_ms()
-        if desired != self._pending_state:
+        if desired is not self._pending_state:
             self._pending_state = desired
             self._pending_since_ms = now_ms
         debounce_ms = int(self.cfg.get("debounce_ms", 200))
-        if self._diff_ms(now_ms, self._pending_since_ms) >= debounce_ms and desired != self.current_state:
+        if self._diff_ms(now_ms, self._pending_since_ms) >= debounce_ms and desired is not self.current_state:
             old_state = self.current_state
             self.current_state = desired
             self._last_committed_state = desired
@@ -444,13 +529,13 @@ class WaterModule:
         to_bottom = pct <= (bottom - hyst)
         to_low = pct <= (low - hyst)
         to_ok = pct >= (low + hyst)
-        if st == STATE_BOTTOM:
+        if st is STATE_BOTTOM:
             return STATE_BOTTOM if pct <= (bottom + hyst) else (STATE_LOW if pct <= (low - hyst) else STATE_OK)
-        if st == STATE_LOW:
+        if st is STATE_LOW:
             if to_bottom:
                 return STATE_BOTTOM
             return STATE_LOW if pct <= (low + hyst) else STATE_OK
-        if st == STATE_OK:
+        if st is STATE_OK:
             if to_bottom:
                 return STATE_BOTTOM
             return STATE_LOW if to_low else STATE_OK
@@ -469,51 +554,34 @@ class WaterModule:
         try:
             interlock_active = bool(self.cfg.get("interlock_active", True))
             allow_pump_at_low = bool(self.cfg.get("allow_pump_at_low", False))
-
-            # During test mode: force safe unless explicitly allowed
-            if self.test_active and not self.test_allow_outputs:
-                try:
-                    if self._pin_pump and bool(self.cfg.get("use_pump_ok", True)):
-                        self._pin_pump.value(1)
-                    if self._pin_heater and bool(self.cfg.get("use_heater_ok", True)):
-                        self._pin_heater.value(1)
-                    if self._pin_interlock and interlock_active:
-                        self._pin_interlock.value(1)
-                except Exception:
-                    pass
-                return
-
-            # Before system is ready: keep everything safe
-            if not self.ready:
-                try:
-                    if self._pin_pump and bool(self.cfg.get("use_pump_ok", True)):
-                        self._pin_pump.value(1)
-                    if self._pin_heater and bool(self.cfg.get("use_heater_ok", True)):
-                        self._pin_heater.value(1)
-                    if self._pin_interlock and interlock_active:
-                        self._pin_interlock.value(1)
-                except Exception:
-                    pass
-                return
-
-            # Determine safe/ok based on current state and sensor validity
-            ok_for_pump = self.sensor_valid and (self.current_state == STATE_OK or (self.current_state == STATE_LOW and allow_pump_at_low))
-            ok_for_heater = self.sensor_valid and (self.current_state == STATE_OK)
+            use_pump = bool(self.cfg.get("use_pump_ok", True))
+            use_heater = bool(self.cfg.get("use_heater_ok", True))
 
             # Safe is value 1, ok is value 0
+            if (self.test_active and not self.test_allow_outputs) or not self.ready:
+                # Testmodus (tenzij expliciet vrijgegeven) of nog niet ready: alles veilig
+                pump_val = heater_val = interlock_val = 1
+            else:
+                # Determine safe/ok based on current state and sensor validity
+                ok_for_pump = self.sensor_valid and (self.current_state is STATE_OK or (self.current_state is STATE_LOW and allow_pump_at_low))
+                ok_for_heater = self.sensor_valid and (self.current_state is STATE_OK)
+                pump_val = 0 if ok_for_pump else 1
+                heater_val = 0 if ok_for_heater else 1
+                interlock_val = 1 if not ok_for_pump else 0
+
             try:
-                if self._pin_pump and bool(self.cfg.get("use_pump_ok", True)):
-                    self._pin_pump.value(0 if ok_for_pump else 1)
+                if self._pin_pump and use_pump:
+                    self._pin_pump.value(pump_val)
             except Exception:
                 pass
             try:
-                if self._pin_heater and bool(self.cfg.get("use_heater_ok", True)):
-                    self._pin_heater.value(0 if ok_for_heater else 1)
+                if self._pin_heater and use_heater:
+                    self._pin_heater.value(heater_val)
             except Exception:
                 pass
             try:
                 if self._pin_interlock and interlock_active:
-                    self._pin_interlock.value(1 if not ok_for_pump else 0)
+                    self._pin_interlock.value(interlock_val)
             except Exception:
                 pass
         except Exception as e:
@@ -525,9 +593,7 @@ class WaterModule:
             return
         
         elapsed = time.time() - self.test_start_time
-        period = self.cfg["test_period_s"]
-        if period <= 0:
-            period = 20
+        period = self._test_period_s
         # Generate sawtooth percentage (100 -> 0 over 'period')
         frac = (elapsed % period) / period
         self.test_pct = max(0.0, min(100.0, 100.0 * (1.0 - frac)))
@@ -565,34 +631,27 @@ class WaterModule:
             
         # Send test data via BLE - use same format as _send_status for consistency
         if self.ble and (force_send or (self._diff_ms(now_ms, self._last_test_ble_ms) >= 1000)):
-            test_data = {
-                "seq": self.seq,
-                "ts_ms": int(time.time() * 1000),
-                # Core status fields (same as _send_status)
-                "state": self.current_state,
-                "pct": self.test_pct,
-                "ready": self.ready,
-                "test_active": True,
-                "current_level_mm": self.test_level,
-                "last_sensor_time": self.last_sensor_time,
-                "ema_mm": self.ema_level if self.sensor_valid else None,
-                "obs_min": self.cfg["min_mm"],
-                "obs_max": self.cfg["max_mm"],
-                
-                # Test specific fields
-                "evt": "test",
-                "test_data_id": self.test_data_id,
-                "test_elapsed": elapsed,
-                "test_period": period,
-                
-                # DEBUG fields for consistency
-                "DEBUG_test_level": self.test_level,
-                "DEBUG_current_level": self.current_level,
-                "DEBUG_sensor_valid": self.sensor_valid,
-                "DEBUG_test_data_active": self.test_data_active
-            }
             try:
-                payload = json.dumps(test_data)
+                # Zelfde kernvelden als _send_status, plus testvelden
+                payload = _TEST_FMT % (
+                    self.seq,
+                    int(time.time() * 1000),
+                    self.current_state,
+                    json_literal(self.test_pct),
+                    json_literal(self.ready),
+                    json_literal(self.test_level),
+                    json_literal(self.last_sensor_time),
+                    json_literal(self.ema_level if self.sensor_valid else None),
+                    json_literal(self.cfg["min_mm"]),
+                    json_literal(self.cfg["max_mm"]),
+                    self.test_data_id,
+                    json_literal(elapsed),
+                    json_literal(period),
+                    json_literal(self.test_level),
+                    json_literal(self.current_level),
+                    json_literal(self.sensor_valid),
+                    json_literal(self.test_data_active),
+                )
                 if force_send and hasattr(self.ble, 'notify_priority'):
                     self.ble.notify_priority(payload)
                 else:
@@ -606,6 +665,7 @@ class WaterModule:
         # Always log test data locally (even if not sent via BLE due to rate limiting)
         log("info", f"Test data: level={self.test_level:.1f}mm, pct={self.test_pct:.1f}%, state={self.current_state}")
     
+    @micropython.native
     def _read_sensor(self):
         """Lees UART-buffer niet-blokkerend, parse mm-waarde en valideer met grenzen.
 
@@ -620,20 +680,21 @@ class WaterModule:
             # Testinjectie: simuleer uart.read() chunking
             if self.test_active and self.test_pipeline and self._test_inject_queue:
                 try:
-                    inj = self._test_inject_queue.pop(0)
+                    inj = self._test_inject_queue.popleft()
                     if inj:
                         self._uart_buf += inj
                         data_added = True
                 except Exception:
                     pass
             # Echte UART
-            if self.uart and self.uart.any():
+            avail = self.uart.any() if self.uart else 0
+            if avail:
                 try:
-                    chunk = self.uart.read()
+                    n = self.uart.readinto(self._rx_buf, min(avail, len(self._rx_buf)))
                 except Exception:
-                    chunk = None
-                if chunk:
-                    self._uart_buf += chunk
+                    n = None
+                if n:
+                    self._uart_buf += self._rx_mv[:n]
                     data_added = True
             # Cap buffer en verwerk complete regels
             if data_added:
@@ -643,19 +704,23 @@ class WaterModule:
                     max_buf = 256
                 if len(self._uart_buf) > max_buf:
                     self._uart_buf = self._uart_buf[-max_buf:]
-                while b"\n" in self._uart_buf:
-                    line, _, rest = self._uart_buf.partition(b"\n")
-                    self._uart_buf = rest
-                    self._process_uart_text_line(line)
+                # Eén scan over de buffer: elke newline wordt één keer gevonden
+                # en de rest wordt pas na de laatste complete regel afgesneden
+                buf = self._uart_buf
+                start = 0
+                nl = buf.find(b"\n")
+                while nl >= 0:
+                    self._process_uart_text_line(buf[start:nl])
+                    start = nl + 1
+                    nl = buf.find(b"\n", start)
+                if start:
+                    self._uart_buf = buf[start:]
             else:
                 # No data available; check timeout to flag sensor fault
-                try:
-                    timeout_ms = int(self.cfg.get("timeout_ms", 1200))
-                except Exception:
-                    timeout_ms = 1200
+                timeout_ms = self._timeout_ms
                 # If we've never had a reading, use boot-time as reference
-                last_s = self.last_sensor_time or self.boot_time
-                if ((time.time() - last_s) * 1000) >= timeout_ms:
+                last_ms = self._last_sensor_ms if self._last_sensor_ms is not None else self._boot_ms
+                if self._diff_ms(self._now_ms(), last_ms) >= timeout_ms:
                     if self.sensor_valid:
                         log("warn", "Sensor timeout - marking sensor_invalid")
                     self.sensor_valid = False
@@ -665,22 +730,27 @@ class WaterModule:
             log("error", f"UART read failed: {e}")
             self.sensor_valid = False
 
+    @micropython.native
     def _process_uart_text_line(self, raw_line):
         """Parse één UART-regel meting in mm en werk sensortoestand bij.
 
         - Negeer lege/corrupte regels of commentaar (#)
+        - Tel negatieve, te grote of exponent-getallen als mislukte meting
         - Clamp naar plausibel bereik [min_mm, max_mm]
         - Houd eenvoudige fail-counter bij om korte glitches te negeren
         """
         try:
-            if isinstance(raw_line, (bytes, bytearray)):
-                s = raw_line.decode('utf-8', 'ignore')
-            else:
-                s = str(raw_line)
-            s = s.replace('\r', '').strip()
-            if not s or s.startswith('#'):
+            if not isinstance(raw_line, (bytes, bytearray)):
+                raw_line = str(raw_line).encode()
+            # Parse direct op de bytes (Viper); < 0 = geen bruikbare waarde
+            tenths = parse_mm_tenths(raw_line, len(raw_line))
+            if tenths < 0:
+                # Getal buiten het meetbereik telt als mislukte meting;
+                # lege/corrupte regels en commentaar worden genegeerd
+                if tenths == PARSE_OUT_OF_RANGE:
+                    self._count_sensor_fail()
                 return
-            mm = float(s)
+            mm = tenths / 10.0
         except Exception:
             return
 
@@ -692,12 +762,7 @@ class WaterModule:
 
         # Buiten plausibel venster met marge → fout tellen
         if mm < (mn - 10) or mm > (mx + 10):
-            try:
-                self._sensor_fail_count += 1
-                if self._sensor_fail_count >= self._sensor_fail_threshold:
-                    self.sensor_valid = False
-            except Exception:
-                self.sensor_valid = False
+            self._count_sensor_fail()
             return
 
         if mm < mn:
@@ -708,8 +773,18 @@ class WaterModule:
         self.current_level = mm
         self.sensor_valid = True
         self.last_sensor_time = time.time()
+        self._last_sensor_ms = self._now_ms()
         self._sensor_fail_count = 0
 
+    def _count_sensor_fail(self):
+        """Tel een mislukte meting; na `_sensor_fail_threshold` op rij is de sensor ongeldig."""
+        try:
+            self._sensor_fail_count += 1
+            if self._sensor_fail_count >= self._sensor_fail_threshold:
+                self.sensor_valid = False
+        except Exception:
+            self.sensor_valid = False
+
     def _enqueue_test_uart_line(self, level_mm):
         """Bouw een UART-regel voor `level_mm` met optionele ruis/corruptie en splits in chunks.
 
@@ -771,8 +846,13 @@ class WaterModule:
         except Exception:
             pass
     
-    def _send_status(self):
-        """Verzend een geconsolideerde statuspayload via BLE (max 1×/s)."""
+    def _send_status(self, force=False):
+        """Verzend een geconsolideerde statuspayload via BLE (max 1×/s).
+
+        Ongewijzigde status wordt overgeslagen tot `ble_status_keepalive_ms`
+        verstreken is; de toestandsupdate zelf loopt wel elke aanroep.
+        `force=True` (expliciete push na CAL/CFG-commando's) verzendt altijd.
+        """
         if not self.ble:
             return
         
@@ -801,30 +881,51 @@ class WaterModule:
             # Tijdens sensorfout geen waterniveau tonen (UI laat '—' zien)
             pct_for_display = pct if is_valid else None
 
-            status_data = {
-                "seq": self.seq,
-                "ts_ms": int(time.time() * 1000),
-                "state": self.current_state,
-                "pct": pct_for_display,
-                "ready": self.ready,
-                "test_active": self.test_active,
-                "current_level_mm": display_level,
-                "last_sensor_time": self.last_sensor_time,
-                # Add fields that the dashboard expects for the gauge
-                "ema_mm": (self.ema_level if is_valid else None),  # None if invalid
-                "obs_min": self.cfg["min_mm"],
-                "obs_max": self.cfg["max_mm"],
-                # Provide validity explicitly
-                "sensor_valid": bool(self.sensor_valid),
-                # DEBUG FIELDS
-                "DEBUG_test_level": self.test_level,
-                "DEBUG_current_level": self.current_level,
-                "DEBUG_sensor_valid": self.sensor_valid,
-                "DEBUG_test_data_active": self.test_data_active
-            }
-            self.ble.notify(json.dumps(status_data))
+            ema_for_display = self.ema_level if is_valid else None
+
+            # Alleen verzenden bij een zichtbare wijziging of als de keepalive
+            # verlopen is; afgeronde waarden zodat ruis geen push veroorzaakt.
+            # Aantal verbindingen in de sleutel: nieuwe central krijgt direct status.
+            key = (
+                self.current_state,
+                None if pct_for_display is None else round(pct_for_display, 1),
+                None if ema_for_display is None else round(ema_for_display, 1),
+                self.ready,
+                self.test_active,
+                self.test_data_active,
+                bool(self.sensor_valid),
+                len(self.ble.connections),
+            )
+            keepalive_ms = self.cfg["ble_status_keepalive_ms"]
+            now_ms = self._now_ms()
+            if (not force and keepalive_ms and key == self._last_status_key
+                    and self._diff_ms(now_ms, self._last_status_sent_ms) < keepalive_ms):
+                return
+
+            # ema_mm is None bij ongeldige sensor; validiteit expliciet meegeven
+            status_msg = _STATUS_FMT % (
+                self.seq,
+                int(time.time() * 1000),
+                self.current_state,
+                json_literal(pct_for_display),
+                json_literal(self.ready),
+                json_literal(self.test_active),
+                json_literal(display_level),
+                json_literal(self.last_sensor_time),
+                json_literal(ema_for_display),
+                json_literal(self.cfg["min_mm"]),
+                json_literal(self.cfg["max_mm"]),
+                json_literal(bool(self.sensor_valid)),
+                json_literal(self.test_level),
+                json_literal(self.current_level),
+                json_literal(self.sensor_valid),
+                json_literal(self.test_data_active),
+            )
+            self.ble.notify(status_msg)
             self.seq = (self.seq + 1) & 0xFFFFFFFF
-            log("info", f"[TRACE] Status SENT: {status_data}")
+            self._last_status_key = key
+            self._last_status_sent_ms = now_ms
+            log("info", f"[TRACE] Status SENT: {status_msg}")
         except Exception as e:
             log("error", f"Failed to send status: {e}")
     
@@ -966,61 +1067,80 @@ class WaterModule:
         te detecteren en te resetten.
         """
         log("info", "WaterModule starting main loop")
+
+        # Proactieve GC: de drempel start een collectie zodra ~een kwart van het
+        # vrije geheugen is gealloceerd, i.p.v. een collect() per tick of één
+        # lange pauze wanneer de heap vol raakt (drempel na init-allocaties bepalen)
+        try:
+            gc.collect()
+            gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
+        except Exception:
+            pass
+
+        # Vaste callables eenmalig binden: de lus gebruikt dan locals i.p.v.
+        # per iteratie attribuut-/module-lookups
+        now_ms_fn = self._now_ms
+        diff_ms = self._diff_ms
+        sleep = time.sleep
+        check_ready = self._check_ready
+        read_sensor = self._read_sensor
+        generate_test_data = self._generate_test_data
+        update_level_state = self._update_level_state
+        send_status = self._send_status
+        # LED en watchdog worden alleen in __init__ aangemaakt
+        led = getattr(self, 'led', None)
+        wdt = self._wdt
         
         try:
             while True:
                 try:
-                    self._check_ready()
+                    check_ready()
                     
                     if self.uart:
-                        self._read_sensor()
+                        read_sensor()
                     
                     if self.test_active:
-                        self._generate_test_data()
+                        generate_test_data()
                     else:
                         # Only update level state when NOT in test mode
                         # This prevents overwriting the correct state set in stop_test()
-                        self._update_level_state()
+                        update_level_state()
                     
                     # No explicit flush with simple notify
 
                     # Send status periodically
                     # - Skip during classic test to avoid BLE conflicts
                     # - Send during pipeline test to verify full flow
-                    now_ms = self._now_ms()
-                    if ((not self.test_active) or self.test_pipeline) and (self._diff_ms(now_ms, self._last_status_ms) >= 1000):
-                        log("info", f"[TRACE] Main loop sending status - test_active={self.test_active}")
-                        self._send_status()
+                    now_ms = now_ms_fn()
+                    if ((not self.test_active) or self.test_pipeline) and (diff_ms(now_ms, self._last_status_ms) >= 1000):
+                        log("info", f"[TRACE] Main loop status check - test_active={self.test_active}")
+                        send_status()
                         self._last_status_ms = now_ms
                     
                     # Watchdog: if test is active but no test packet in 1.5s, force one
-                    if self.test_active and (self._diff_ms(now_ms, self._last_test_ble_ms) >= 1500):
-                        self._generate_test_data(force_send=True)
+                    if self.test_active and (diff_ms(now_ms, self._last_test_ble_ms) >= 1500):
+                        generate_test_data(force_send=True)
                         self._last_test_ble_ms = now_ms
                     
                     # Blink LED using initialized pin
-                    if getattr(self, 'led', None) is not None:
+                    if led is not None:
                         try:
-                            self.led.value(0 if self.led.value() else 1)
+                            led.value(0 if led.value() else 1)
                         except Exception:
                             pass
                     
-                    # Periodic garbage collection to avoid fragmentation
-                    try:
-                        gc.collect()
-                    except Exception:
-                        pass
                     # Feed hardware watchdog if present
-                    if self._wdt:
+                    if wdt and diff_ms(now_ms, self._last_wdt_feed_ms) >= self._wdt_feed_ms:
+                        self._last_wdt_feed_ms = now_ms
                         try:
-                            self._wdt.feed()
+                            wdt.feed()
                         except Exception:
                             pass
                 except Exception as loop_err:
                     # Log and continue; never let the loop die
                     log("err", f"Loop error: {loop_err}")
                 
-                time.sleep(1.0 / self.cfg["sample_hz"])
+                sleep(self._loop_sleep_s)
                 
         except KeyboardInterrupt:
             log("info", "Stopped by user")